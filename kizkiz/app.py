@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # encoding: utf-8
 from functools import partial
 
@@ -11,64 +11,94 @@ class KizKizApp(rumps.App):
     def __init__(self):
         super(KizKizApp, self).__init__('KizKiz')
 
+        #: The EQ presets the current menu was built from, or `None`
+        #: if the menu hasn't been built yet.
+        self._eq_presets = None
+
         self.zik = next(kbt.ZikProxy.find_all_ziks())
         self.zik.register(self.status_update)
         self.zik.connect()
 
     def build_menu(self):
+        """
+        Rebuild the entire menu from scratch. Only needed when the
+        structure of the menu changes (such as the list of EQ presets),
+        otherwise use `update_menu()`.
+        """
         self.menu.clear()
 
         zik = self.zik
-        bs = zik.BatteryState
+
+        self._battery_item = rumps.MenuItem('Battery')
+        self._nc_item = rumps.MenuItem(
+            'Noise Cancellation',
+            callback=self.on_noise_cancellation
+        )
+        self._lou_item = rumps.MenuItem(
+            'Lou Reed Mode',
+            callback=self.on_lou_reed_mode
+        )
+        self._eq_items = [
+            rumps.MenuItem(p[1], callback=partial(self.on_eq, p[1], p[0]))
+            for p in zik.s_eq_presets
+        ] + [
+            rumps.MenuItem(
+                'Disabled',
+                callback=partial(self.on_eq, None, None)
+            )
+        ]
+        self._version_item = rumps.MenuItem('Firmware Version')
+        self._eq_presets = zik.s_eq_presets
 
         self.menu.update([
             'Connected: {name}'.format(name=zik.name),
-            rumps.MenuItem('Battery: {0}'.format({
-                bs.CHARGING: 'Charging',
-                bs.CALC: 'Calculating...',
-                bs.IN_USE: '{0}%'.format(zik.s_battery_level)
-            }[self.zik.s_battery_state])),
+            self._battery_item,
             rumps.separator,
-            rumps.MenuItem(
-                'Noise Cancellation',
-                callback=self.on_noise_cancellation
-            ),
-            rumps.MenuItem(
-                'Lou Reed Mode',
-                callback=self.on_lou_reed_mode
-            ),
-            ('EQ', [
-                rumps.MenuItem(p[1], callback=partial(self.on_eq, p[1], p[0]))
-                for p in zik.s_eq_presets
-            ] + [
+            self._nc_item,
+            self._lou_item,
+            ('EQ', self._eq_items[:-1] + [
                 rumps.separator,
-                rumps.MenuItem(
-                    'Disabled',
-                    callback=partial(self.on_eq, None, None)
-                )
+                self._eq_items[-1]
             ]),
             ('Advanced', [
-                'Firmware Version: {0}'.format(zik.s_version)
+                self._version_item
             ]),
             rumps.separator,
             rumps.MenuItem('Quit', callback=self.on_quit)
         ])
 
+        self.update_menu()
+
+    def update_menu(self):
+        """
+        Refresh the titles and states of the existing menu items from
+        the current state of the Zik.
+        """
+        zik = self.zik
+        bs = zik.BatteryState
+
+        self._battery_item.title = 'Battery: {0}'.format({
+            bs.CHARGING: 'Charging',
+            bs.CALC: 'Calculating...',
+            bs.IN_USE: '{0}%'.format(zik.s_battery_level)
+        }[zik.s_battery_state])
+        self._version_item.title = 'Firmware Version: {0}'.format(
+            zik.s_version
+        )
+
         # Update some menu states, since unfortunately the
         # current version of rumps doesn't let you set it in the
         # constructor.
-        self.menu['Noise Cancellation'].state = zik.s_noise_cancellation
-        self.menu['Lou Reed Mode'].state = zik.s_lou_reed_mode
+        self._nc_item.state = zik.s_noise_cancellation
+        self._lou_item.state = zik.s_lou_reed_mode
 
-        for eq_title, eq_item in self.menu['EQ'].items():
-            if not eq_title:
-                # Skip over seperators
-                continue
+        if zik.s_eq_enabled:
+            active_eq = zik.s_eq_preset_name
+        else:
+            active_eq = 'Disabled'
 
-            if zik.s_eq_enabled:
-                eq_item.state = eq_title == zik.s_eq_preset_name
-            else:
-                eq_item.state = eq_title == 'Disabled'
+        for eq_item in self._eq_items:
+            eq_item.state = eq_item.title == active_eq
 
     def on_quit(self, _):
         rumps.quit_application()
@@ -86,15 +116,18 @@ class KizKizApp(rumps.App):
             print('tried to set to', id_)
             self.zik.s_eq_preset_id = id_
 
-        # Rebuild the EQ menu
-        self.build_menu()
+        # Refresh the EQ menu
+        self.update_menu()
 
     def on_lou_reed_mode(self, sender):
         self.zik.s_lou_reed_mode = not sender.state
         sender.state = not sender.state
 
     def status_update(self, zik):
-        self.build_menu()
+        if zik.s_eq_presets != self._eq_presets:
+            self.build_menu()
+        else:
+            self.update_menu()
 
 if __name__ == "__main__":
     KizKizApp().run()
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # encoding: utf-8
 """
 Sources:
@@ -10,13 +10,49 @@ Sources:
 3: IOBluetooth.framework/Headers/objc/IOBluetoothRFCOMMChannel.h
 """
 import ctypes
+import os
 import struct
-from cStringIO import StringIO
+import xml.etree.ElementTree as ET
 
 import objc
-objc.setVerbose(1)
+if os.environ.get('KIZKIZ_DEBUG'):
+    objc.setVerbose(1)
 import Foundation as foundation
-import xmltodict
+
+#: The common packet header, the total packet size (including the header)
+#: followed by the packet type.
+_HDR = struct.Struct('>HB')
+#: The unknown (but always present) prefix on a GET response body.
+_GET_RESP = struct.Struct('>BBH')
+
+#: Request methods.
+_GET = b'GET'
+_SET = b'SET'
+
+
+def _encode_request(method, endpoint, value=None):
+    """
+    Encodes a complete Zik API request packet, ready to be written to
+    the RFCOMM channel. See :meth:`ZikProxy._request()`.
+    """
+    parts = [method, b' ', endpoint]
+
+    if value is not None:
+        # For convienience, convert True/False.
+        if value is True:
+            arg = b'true'
+        elif value is False:
+            arg = b'false'
+        else:
+            arg = str(value).encode('ascii')
+
+        parts.append(b'?arg=')
+        parts.append(arg)
+
+    message = b''.join(parts)
+
+    # +3 for the header, which is included in the size.
+    return _HDR.pack(len(message) + 3, 0x80) + message
 
 
 class ZikError(Exception):
@@ -41,7 +77,7 @@ class BluetoothProxy(Proxy):
         objc.loadBundle(
             'IOBluetooth',
             self,
-            bundle_path=u'/System/Library/Frameworks/IOBluetooth.framework'
+            bundle_path='/System/Library/Frameworks/IOBluetooth.framework'
         )
 
         # Thank you mailing list archives. Figured out how to
@@ -63,30 +99,50 @@ class BluetoothProxy(Proxy):
         )
 
 
+#: The shared BluetoothProxy, see `get_bluetooth_proxy()`.
+_bluetooth_proxy = None
+
+
+def get_bluetooth_proxy():
+    """
+    Returns the shared :class:`BluetoothProxy`, loading the IOBluetooth
+    framework the first time it's needed.
+    """
+    global _bluetooth_proxy
+    if _bluetooth_proxy is None:
+        _bluetooth_proxy = BluetoothProxy()
+    return _bluetooth_proxy
+
+
 class ZikProxy(object):
     ZIK_SERVICE_NAME = 'Parrot RFcomm service'
     ZIK_SERVICE_UUID = '0ef0f502-f0ee-46c9-986c-54ed027807fb'
 
-    ZIK_SYS_BATTERY_GET = '/api/system/battery/get'
-    ZIK_SYS_DEVICE_TYPE_GET = '/api/system/device_type/get'
-    ZIK_SYS_VERSION_GET = '/api/software/version/get'
+    ZIK_SYS_BATTERY_GET = b'/api/system/battery/get'
+    ZIK_SYS_DEVICE_TYPE_GET = b'/api/system/device_type/get'
+    ZIK_SYS_VERSION_GET = b'/api/software/version/get'
 
-    ZIK_SYS_HEAD_DETECT_GET = '/api/system/head_detection/enabled/get'
-    ZIK_SYS_HEAD_DETECT_SET = '/api/system/head_detection/enabled/set'
+    ZIK_SYS_HEAD_DETECT_GET = b'/api/system/head_detection/enabled/get'
+    ZIK_SYS_HEAD_DETECT_SET = b'/api/system/head_detection/enabled/set'
 
-    ZIK_AUDIO_NOISE_GET = '/api/audio/noise_cancellation/enabled/get'
-    ZIK_AUDIO_NOISE_SET = '/api/audio/noise_cancellation/enabled/set'
+    ZIK_AUDIO_NOISE_GET = b'/api/audio/noise_cancellation/enabled/get'
+    ZIK_AUDIO_NOISE_SET = b'/api/audio/noise_cancellation/enabled/set'
 
-    ZIK_AUDIO_SPECIFIC_MODE_GET = '/api/audio/specific_mode/enabled/get'
-    ZIK_AUDIO_SPECIFIC_MODE_SET = '/api/audio/specific_mode/enabled/set'
+    ZIK_AUDIO_SPECIFIC_MODE_GET = b'/api/audio/specific_mode/enabled/get'
+    ZIK_AUDIO_SPECIFIC_MODE_SET = b'/api/audio/specific_mode/enabled/set'
 
-    ZIK_EQ_GET = '/api/audio/equalizer/get'
-    ZIK_EQ_PRESETS_GET = '/api/audio/equalizer/presets_list/get'
-    ZIK_EQ_ENABLE_SET = '/api/audio/equalizer/enabled/set'
-    ZIK_EQ_PRESET_SET = '/api/audio/equalizer/preset_id/set'
+    ZIK_EQ_GET = b'/api/audio/equalizer/get'
+    ZIK_EQ_PRESETS_GET = b'/api/audio/equalizer/presets_list/get'
+    ZIK_EQ_ENABLE_SET = b'/api/audio/equalizer/enabled/set'
+    ZIK_EQ_PRESET_SET = b'/api/audio/equalizer/preset_id/set'
 
     kIOReturnSuccess = 0
 
+    #: How long to wait (in seconds) after a state change before
+    #: notifying handlers, so a burst of packets results in a single
+    #: notification.
+    NOTIFY_DELAY = 0.05
+
     class BatteryState(object):
         #: The battery is currently in use, meaning the headphones
         #: are unplugged and on.
@@ -100,18 +156,25 @@ class ZikProxy(object):
     def __init__(self, bp, device):
         self.device = device
         self.bp = bp
+        #: The advertised name of the device, which doesn't change.
+        self._name = device.name()
 
         self._handlers = set()
         #: The RFCOMM channel.
         self._channel = None
         #: The RFCOMM channel event listener.
         self._listener = None
+        #: `True` if a notification of registered handlers has been
+        #: scheduled but not yet run.
+        self._dirty = False
 
         self._s_version = None
         self._s_battery_level = 0
         self._s_battery_state = ZikProxy.BatteryState.IN_USE
         self._s_noise_cancellation = False
-        self._s_eq_presets = []
+        self._s_eq_presets = ()
+        #: Maps a preset ID to its (id, name) tuple in `_s_eq_presets`.
+        self._preset_by_id = {}
         self._s_eq_preset_id = None
         self._s_eq_enabled = False
         self._s_specific_mode = False
@@ -128,7 +191,7 @@ class ZikProxy(object):
         """
         Yields all of the Parrot Ziks already paired to this machine
         """
-        bp = BluetoothProxy()
+        bp = get_bluetooth_proxy()
         devices = bp.IOBluetoothDevice.pairedDevices()
 
         for device in devices:
@@ -165,7 +228,7 @@ class ZikProxy(object):
         # Do the handshake, which is the length (00 03) and the packet
         # type (00). From this point, we can start sending regular
         # requests.
-        self._write('\x00\x03\x00')
+        self._write(b'\x00\x03\x00')
         self.update_status()
 
     @property
@@ -173,7 +236,7 @@ class ZikProxy(object):
         """
         The name of this Zik device (as advertised by BT).
         """
-        return self.device.name()
+        return self._name
 
     def _write(self, data):
         """
@@ -190,31 +253,14 @@ class ZikProxy(object):
 
         This API is HTTP-ish.
 
-        :param method: The request method (GET or SET)
-        :param endpoint: The path to request.
+        :param method: The request method (`_GET` or `_SET`)
+        :param endpoint: The path to request, as a byte string.
         :param value: If making a SET request, this is the value to
                       set.
         """
-        message = bytearray()
-        message.extend(method)
-        message.append(' ')
-        message.extend(str(endpoint))
-
-        if value is not None:
-            # For convienience, convert True/False.
-            message.extend('?arg={value}'.format(value={
-                True: 'true',
-                False: 'false'
-            }.get(value, value)))
-
-        self._write(
-            struct.pack('>HB{count}s'.format(
-                # +3 for the header, which is included in the size.
-                count=len(message)
-            ), len(message) + 3, 0x80, str(message))
-        )
+        self._write(_encode_request(method, endpoint, value=value))
 
-    def _handle_packet(self, packet, length):
+    def _handle_packet(self, packet):
         """
         Parse and handle an incoming packet of data over the Zik's
         Bluetooth RFCOMM channel.
@@ -228,92 +274,150 @@ class ZikProxy(object):
             to assume we always get the complete message.
 
         :param packet: A byte string containing the complete packet.
-        :param length: The expected length of the complete packet.
         """
-        io = StringIO(packet)
-
-        packet_size, packet_type = struct.unpack('>HB', io.read(3))
+        packet_size, packet_type = _HDR.unpack_from(packet, 0)
 
         if packet_type == 0x00:
             # Just the handshack ACK, nothing to really do.
             return
         elif packet_type == 0x80:
             # GET Response.
-            x, y, z = struct.unpack('>BBH', io.read(4))
-            left = packet_size - io.tell()
+            x, y, z = _GET_RESP.unpack_from(packet, _HDR.size)
 
             # The packet body is an XML response, with either an
             # "answer" node (in response to a request) or a
             # "notify" node (periodic or in response to a device
             # event).
-            packet_body = xmltodict.parse(
-                struct.unpack(
-                    '>{0}s'.format(left),
-                    io.read(left)
-                )[0]
+            n = ET.fromstring(
+                packet[_HDR.size + _GET_RESP.size:packet_size]
             )
 
-            if 'notify' in packet_body:
-                self._request('GET', packet_body['notify']['@path'])
-                return
-
-            try:
-                n = packet_body['answer']
-            except KeyError:
+            if n.tag not in ('notify', 'answer'):
                 raise ZikProtocolError('unknown message type')
 
             # The path is the api endpoint that's been SET or GET'd
             # echo'd back at us.
-            path = n['@path']
-
-            if path == self.ZIK_SYS_BATTERY_GET:
-                # Handles battery level and state updates.
-                battery = n['system']['battery']
-
-                if battery['@state'] == 'charging':
-                    self._s_battery_level = -1
-                    self._s_battery_state = ZikProxy.BatteryState.CHARGING
-                else:
-                    self._s_battery_state = ZikProxy.BatteryState.IN_USE
-                    if battery['@level'] == '':
-                        # We can be IN_USE but not yet know what the battery
-                        # level is (likely because it was just unplugged.)
-                        # The Zik will send another NOTIFY event when it
-                        # knows what the real level is.
-                        self._s_battery_level = 0
-                        self._s_battery_state = ZikProxy.BatteryState.CALC
-                    else:
-                        self._s_battery_level = int(battery['@level'])
-            elif path == self.ZIK_AUDIO_NOISE_GET:
-                # Handles noise cancellation updates.
-                enabled = n['audio']['noise_cancellation']['@enabled']
-                self._s_noise_cancellation = enabled == 'true'
-            elif path == self.ZIK_SYS_VERSION_GET:
-                # Handles system software version updates.
-                self._s_version = n['software']['@version']
-            elif path == self.ZIK_AUDIO_SPECIFIC_MODE_GET:
-                # The so called "Lou Reed" mode.
-                print(packet_body)
-                enabled = n['audio']['specific_mode']['@enabled']
-                self._s_specific_mode = enabled == 'true'
-            elif path == self.ZIK_EQ_PRESETS_GET:
-                # Handles EQ preset lists.
-                eq = n['audio']['equalizer']
-                presets = eq['presets_list']['preset']
-                self._s_eq_presets = [
-                    (int(p['@id']), p['@name']) for p in presets
-                ]
-            elif path == self.ZIK_EQ_GET:
-                eq = n['audio']['equalizer']
-                self._s_eq_enabled = eq['@enabled'] == 'true'
-                self._s_eq_preset_id = int(eq['@preset_id'])
+            path = n.get('path')
+            if path is None:
+                raise ZikProtocolError('message has no path')
+            path = path.encode('ascii')
+
+            if n.tag == 'notify':
+                self._request(_GET, path)
+                return
+
+            handler = self._PATH_DISPATCH.get(path)
+            if handler is not None:
+                handler(self, n)
             else:
-                print(packet_body)
+                print(ET.tostring(n))
 
             # Tell anyone whose interested that our state has probably been
-            # changed.
-            for handler in self._handlers:
-                handler(self)
+            # changed. Scheduled in the common modes so it still fires
+            # while a menu is open (event tracking mode).
+            if not self._dirty:
+                self._dirty = True
+                self._listener.performSelector_withObject_afterDelay_inModes_(
+                    'notifyHandlers:',
+                    None,
+                    ZikProxy.NOTIFY_DELAY,
+                    [foundation.NSRunLoopCommonModes]
+                )
+
+    def _notify_handlers(self):
+        """
+        Trigger all registered callbacks, clearing any pending
+        notification.
+        """
+        self._dirty = False
+        for handler in self._handlers:
+            handler(self)
+
+    def _h_battery(self, n):
+        """
+        Handles battery level and state updates.
+        """
+        battery = n.find('system/battery')
+
+        if battery.get('state') == 'charging':
+            self._s_battery_level = -1
+            self._s_battery_state = ZikProxy.BatteryState.CHARGING
+        else:
+            self._s_battery_state = ZikProxy.BatteryState.IN_USE
+            level = battery.get('level')
+            if not level:
+                # We can be IN_USE but not yet know what the battery
+                # level is (likely because it was just unplugged.)
+                # The Zik will send another NOTIFY event when it
+                # knows what the real level is.
+                self._s_battery_level = 0
+                self._s_battery_state = ZikProxy.BatteryState.CALC
+            else:
+                self._s_battery_level = int(level)
+
+    def _h_noise(self, n):
+        """
+        Handles noise cancellation updates.
+        """
+        enabled = n.find('audio/noise_cancellation').get('enabled')
+        self._s_noise_cancellation = enabled == 'true'
+
+    def _h_version(self, n):
+        """
+        Handles system software version updates.
+        """
+        self._s_version = n.find('software').get('version')
+
+    def _h_specific_mode(self, n):
+        """
+        Handles the so called "Lou Reed" mode updates.
+        """
+        enabled = n.find('audio/specific_mode').get('enabled')
+        self._s_specific_mode = enabled == 'true'
+
+    def _h_eq_presets(self, n):
+        """
+        Handles EQ preset lists.
+        """
+        presets = n.findall('audio/equalizer/presets_list/preset')
+        self._s_eq_presets = tuple(
+            (int(p.get('id')), p.get('name')) for p in presets
+        )
+        self._preset_by_id = dict(
+            (preset[0], preset) for preset in self._s_eq_presets
+        )
+
+    def _h_eq(self, n):
+        """
+        Handles EQ enabled and active preset updates.
+        """
+        eq = n.find('audio/equalizer')
+        self._s_eq_enabled = eq.get('enabled') == 'true'
+        self._s_eq_preset_id = int(eq.get('preset_id'))
+
+    #: Maps an API path echo'd back in an answer to the handler
+    #: responsible for updating our state from it.
+    _PATH_DISPATCH = {
+        ZIK_SYS_BATTERY_GET: _h_battery,
+        ZIK_AUDIO_NOISE_GET: _h_noise,
+        ZIK_SYS_VERSION_GET: _h_version,
+        ZIK_AUDIO_SPECIFIC_MODE_GET: _h_specific_mode,
+        ZIK_EQ_PRESETS_GET: _h_eq_presets,
+        ZIK_EQ_GET: _h_eq
+    }
+
+    #: The GET requests for every known endpoint, framed and joined
+    #: ahead of time so `update_status()` is a single write.
+    STATUS_QUERIES = b''.join(
+        _encode_request(_GET, path) for path in (
+            ZIK_SYS_VERSION_GET,
+            ZIK_SYS_BATTERY_GET,
+            ZIK_AUDIO_NOISE_GET,
+            ZIK_AUDIO_SPECIFIC_MODE_GET,
+            ZIK_EQ_GET,
+            ZIK_EQ_PRESETS_GET
+        )
+    )
 
     def update_status(self):
         """
@@ -326,17 +430,16 @@ class ZikProxy(object):
             is established - there's usually no need to call this
             manually.
         """
-        self._request('GET', self.ZIK_SYS_VERSION_GET)
-        self._request('GET', self.ZIK_SYS_BATTERY_GET)
-        self._request('GET', self.ZIK_AUDIO_NOISE_GET)
-        self._request('GET', self.ZIK_AUDIO_SPECIFIC_MODE_GET)
-        self._request('GET', self.ZIK_EQ_GET)
-        self._request('GET', self.ZIK_EQ_PRESETS_GET)
+        self._write(self.STATUS_QUERIES)
 
     def register(self, handler):
         """
         Register a callback. When the status of the Parrot Zik changes,
         all registered callbacks will be trigged.
+
+        Callbacks are not called from within the packet callback; they
+        are coalesced and delivered `NOTIFY_DELAY` seconds later on the
+        run loop, once per burst of packets.
         """
         self._handlers.add(handler)
 
@@ -382,8 +485,10 @@ class ZikProxy(object):
     @s_noise_cancellation.setter
     def s_noise_cancellation(self, value):
         assert(isinstance(value, bool))
+        if value == self._s_noise_cancellation:
+            return
+        self._request(_SET, self.ZIK_AUDIO_NOISE_SET, value=value)
         self._s_noise_cancellation = value
-        self._request('SET', self.ZIK_AUDIO_NOISE_SET, value=value)
 
     @property
     def s_lou_reed_mode(self):
@@ -401,15 +506,17 @@ class ZikProxy(object):
     @s_lou_reed_mode.setter
     def s_lou_reed_mode(self, value):
         assert(isinstance(value, bool))
+        if value == self._s_specific_mode:
+            return
         # Disable the EQ which is required by the Lou Reed mode or we'll
         # get invalid state warnings.
         self.s_eq_enabled = False
-        self._s_specific_mode = True
-        self._request('SET', self.ZIK_AUDIO_SPECIFIC_MODE_SET, value=value)
+        self._request(_SET, self.ZIK_AUDIO_SPECIFIC_MODE_SET, value=value)
+        self._s_specific_mode = value
 
     @property
     def s_eq_presets(self):
-        return self._s_eq_presets[:]
+        return self._s_eq_presets
 
     @property
     def s_eq_preset_id(self):
@@ -417,9 +524,11 @@ class ZikProxy(object):
 
     @s_eq_preset_id.setter
     def s_eq_preset_id(self, value):
-        assert(isinstance(value, (int, long)))
+        assert(isinstance(value, int))
+        if value == self._s_eq_preset_id:
+            return
+        self._request(_SET, self.ZIK_EQ_PRESET_SET, value=value)
         self._s_eq_preset_id = value
-        self._request('SET', self.ZIK_EQ_PRESET_SET, value=value)
 
     @property
     def s_eq_preset_name(self):
@@ -433,13 +542,13 @@ class ZikProxy(object):
     @s_eq_enabled.setter
     def s_eq_enabled(self, value):
         assert(isinstance(value, bool))
+        if value == self._s_eq_enabled:
+            return
+        self._request(_SET, self.ZIK_EQ_ENABLE_SET, value=value)
         self._s_eq_enabled = value
-        self._request('SET', self.ZIK_EQ_ENABLE_SET, value=value)
 
     def preset_by_id(self, id_):
-        for preset in self.s_eq_presets:
-            if preset[0] == id_:
-                return preset
+        return self._preset_by_id.get(id_)
 
 
 class ZikChannelDelegate(foundation.NSObject):
@@ -456,7 +565,11 @@ class ZikChannelDelegate(foundation.NSObject):
         # versions of pyobjc see a NULL byte in the string and stop
         # there.
         packet = ctypes.string_at(data, length)
-        self.callback._handle_packet(packet, length)
+        self.callback._handle_packet(packet)
+
+    @objc.signature('v@:@')
+    def notifyHandlers_(self, _):
+        self.callback._notify_handlers()
 
     def listen(self, channel):
         channel.setDelegate_(self)
@@ -11,15 +11,16 @@ setup(
     author_email="tk@tkte.ch",
     classifiers=[
         "Programming Language :: Python",
+        "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
         "Development Status :: 3 - Alpha",
     ],
     packages=find_packages(),
+    python_requires='>=3.9',
     install_requires=[
         'docopt',
-        'rumps',
-        'xmltodict'
+        'rumps'
     ],
     extras_require={
         'docs': [